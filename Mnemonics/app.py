@@ -1,10 +1,12 @@
 from __future__ import annotations
-import json
+import mmap
 import os
 import re
 from pathlib import Path
-from typing import Dict, Any, Optional, Callable
+from typing import Dict, Any, Optional, Callable, Tuple, Union
 
+import msgspec
+import orjson
 import streamlit as st
 
 # ---------- Paths ----------
@@ -27,6 +29,13 @@ def _read_svg(path: Path) -> Optional[str]:
 
 # Prepare SVG for clean embedding inside Streamlit HTML
 _SVG_OPEN_TAG_RE = re.compile(r"<svg[^>]*>", re.IGNORECASE | re.DOTALL)
+# Comments, XML declarations and DOCTYPE (with optional internal subset) in one pass
+_SVG_HEADER_RE = re.compile(
+    r"<!--.*?-->|<\?xml[^>]*?>|<!DOCTYPE[^>]*>(?:\[[\s\S]*?\])?",
+    re.IGNORECASE | re.DOTALL,
+)
+_SVG_SIZE_ATTR_RE = re.compile(r"\s(?:width|height)=\"[^\"]*\"")
+_SVG_STYLE_RE = re.compile(r"style=\"([^\"]*)\"")
 
 def _sanitize_svg_for_embed(svg_text: str) -> str:
     """Keep only the <svg>...</svg> fragment and make it responsive.
@@ -40,17 +49,13 @@ def _sanitize_svg_for_embed(svg_text: str) -> str:
     end = svg_text.rfind("</svg>")
     frag = svg_text[start:end + len("</svg>")] if (start != -1 and end != -1) else svg_text
     # Strip comments, xml declarations, doctype
-    frag = re.sub(r"<!--.*?-->", "", frag, flags=re.DOTALL)
-    frag = re.sub(r"<\?xml[^>]*?>", "", frag, flags=re.IGNORECASE)
-    frag = re.sub(r"<!DOCTYPE[^>]*>(?:\[[\s\S]*?\])?", "", frag, flags=re.IGNORECASE)
+    frag = _SVG_HEADER_RE.sub("", frag)
     # Remove fixed size and inject responsive style
     def _strip_size(m: re.Match[str]) -> str:
         tag = m.group(0)
-        tag = re.sub(r"\swidth=\"[^\"]*\"", "", tag)
-        tag = re.sub(r"\sheight=\"[^\"]*\"", "", tag)
+        tag = _SVG_SIZE_ATTR_RE.sub("", tag)
         if "style=" in tag:
-            tag = re.sub(
-                r"style=\"([^\"]*)\"",
+            tag = _SVG_STYLE_RE.sub(
                 lambda mm: f"style=\"{mm.group(1)};max-width:420px;width:100%;height:auto;\"",
                 tag,
                 count=1,
@@ -76,81 +81,132 @@ def _inject_svg_style(svg_text: str, *, stroke_color: str = "#ffffff", number_co
     return style_tag + svg_text
 
 @st.cache_data(show_spinner=False)
-def load_kanji_data() -> Dict[str, Any]:
+def _load_sanitized_svg(path_str: str, mtime: float) -> Optional[str]:
+    """Read and sanitize an SVG once per file version (mtime is part of the cache key)."""
+    svg_content = _read_svg(Path(path_str))
+    return _sanitize_svg_for_embed(svg_content) if svg_content else None
+
+@st.cache_data(show_spinner=False)
+def _load_styled_svg(path_str: str, mtime: float, stroke_color: str, number_color: str, stroke_width: int, show_numbers: bool) -> Optional[str]:
+    """Sanitized SVG with the stroke style applied, cached per widget combination."""
+    clean_svg = _load_sanitized_svg(path_str, mtime)
+    if not clean_svg:
+        return None
+    return _inject_svg_style(clean_svg, stroke_color=stroke_color, number_color=number_color, stroke_width=stroke_width, show_numbers=show_numbers)
+
+# Tokens that matter for locating top-level values: strings, brackets and bare scalars
+_JSON_TOKEN_RE = re.compile(rb'"(?:[^"\\]|\\.)*"|[{}\[\]]|[^\s,:{}\[\]"]+')
+_JSON_OBJECT_START_RE = re.compile(rb"\s*\{")
+
+def _index_top_level_values(buf: Union[bytes, mmap.mmap]) -> Dict[str, Tuple[int, int]]:
+    """Scan a JSON object and map each top-level key to the (offset, length)
+    of its value in ``buf``. Nested values are skipped without being decoded.
+    """
+    offsets: Dict[str, Tuple[int, int]] = {}
+    depth = 0
+    key: Optional[str] = None
+    start = 0
+    for m in _JSON_TOKEN_RE.finditer(buf):
+        c = buf[m.start()]
+        if c in b"{[":
+            if depth == 1 and key is not None:
+                start = m.start()
+            depth += 1
+        elif c in b"}]":
+            depth -= 1
+            if depth == 1 and key is not None:
+                offsets[key] = (start, m.end() - start)
+                key = None
+        elif depth == 1:
+            if key is None:
+                key = orjson.loads(m.group(0))
+            else:
+                offsets[key] = (m.start(), m.end() - m.start())
+                key = None
+    return offsets
+
+@st.cache_resource(show_spinner=False)
+def load_kanji_index() -> Dict[str, Tuple[int, int]]:
+    """Build a kanji -> (offset, length) index into merged_kanji.json.
+    Records are decoded lazily by ``get_kanji_info`` instead of loading the whole dataset.
+    """
     if not KANJI_JSON.exists():
         st.warning(f"Kanji dataset not found at {KANJI_JSON}")
         return {}
-    with KANJI_JSON.open("r", encoding="utf-8") as f:
-        data = json.load(f)
-    # Expecting a mapping: kanji -> info dict
-    return data if isinstance(data, dict) else {}
+    if KANJI_JSON.stat().st_size == 0:
+        return {}
+    # Scan the memory-mapped file directly; no read() copy of the whole dataset
+    with KANJI_JSON.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        # Expecting a mapping: kanji -> info dict
+        if not _JSON_OBJECT_START_RE.match(mm):
+            return {}
+        return _index_top_level_values(mm)
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def get_kanji_info(k: str) -> Optional[Dict[str, Any]]:
+    span = load_kanji_index().get(k)
+    if span is None:
+        return None
+    offset, length = span
+    with KANJI_JSON.open("rb") as f:
+        f.seek(offset)
+        try:
+            info = orjson.loads(f.read(length))
+        except orjson.JSONDecodeError:
+            return None
+    return info if isinstance(info, dict) else None
+
+class MnemonicRecord(msgspec.Struct):
+    """Fields of a generated_mnemonics JSONL line used by the app; other keys are ignored."""
+    kanji: Optional[str] = None
+    mnemonic: Optional[str] = None
+    reminder: Optional[str] = None
+
+_MNEMONIC_DECODER = msgspec.json.Decoder(MnemonicRecord)
 
 @st.cache_data(show_spinner=False)
 def load_mnemonics_index() -> Dict[str, Dict[str, str]]:
     idx: Dict[str, Dict[str, str]] = {}
     if not MNEMONICS_JSONL.exists():
         return idx
-    with MNEMONICS_JSONL.open("r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                obj = json.loads(line)
-            except Exception:
-                continue
-            k = obj.get("kanji")
-            if not k:
-                continue
-            # last one wins (resume runs)
-            idx[k] = {
-                "mnemonic": (obj.get("mnemonic") or "").strip(),
-                "reminder": (obj.get("reminder") or "").strip(),
-            }
+    with MNEMONICS_JSONL.open("rb") as f:
+        raw = f.read()
+    for line in raw.splitlines():
+        if not line.strip():
+            continue
+        try:
+            rec = _MNEMONIC_DECODER.decode(line)
+        except msgspec.DecodeError:
+            continue
+        k = rec.kanji
+        if not k:
+            continue
+        # last one wins (resume runs)
+        idx[k] = {
+            "mnemonic": (rec.mnemonic or "").strip(),
+            "reminder": (rec.reminder or "").strip(),
+        }
     return idx
 
 @st.cache_resource(show_spinner=False)
-def load_notebook_generator() -> Optional[Callable[[str], str]]:
-    """Load generate_mnemonic from RAG_Mnemonics.ipynb by executing its code cells.
-    We avoid executing cells that trigger batch runs. Returns a callable or None if failed.
+def load_generator() -> Optional[Callable[[str], str]]:
+    """Import generate_mnemonic from rag_mnemonics.py (extracted from RAG_Mnemonics.ipynb).
+    Returns a callable or None if the module cannot be imported.
     """
-    nb_path = HERE / "RAG_Mnemonics.ipynb"
-    if not nb_path.exists():
-        return None
     try:
-        with nb_path.open("r", encoding="utf-8") as f:
-            nb = json.load(f)
+        import rag_mnemonics
     except Exception:
         return None
+    gen = getattr(rag_mnemonics, "generate_mnemonic", None)
+    return gen if callable(gen) else None
 
-    cells = nb.get("cells", [])
-    code_parts = []
-    for idx, cell in enumerate(cells, start=1):
-        if idx > 11:
-            break
-        if cell.get("cell_type") != "code":
-            continue
-        src_list = cell.get("source", [])
-        if isinstance(src_list, str):
-            src = src_list
-        else:
-            src = "".join(src_list)
-        if "run_batch_with_resume_v3(" in src and "def run_batch_with_resume_v3" not in src:
-            continue
-        if "print(generate_mnemonic(" in src:
-            continue
-        code_parts.append(src)
-
-    code = "\n\n".join(code_parts)
-    ns: Dict[str, Any] = {}
-    try:
-        exec(code, ns)
-        gen = ns.get("generate_mnemonic")
-        if callable(gen):
-            return gen
-        return None
-    except Exception:
-        return None
+@st.cache_data(show_spinner=False, persist="disk")
+def generate_mnemonic_cached(k: str) -> str:
+    """Disk-persisted wrapper around the generator. Exceptions are not cached, so failures are retried."""
+    gen_func = load_generator()
+    if gen_func is None:
+        raise RuntimeError("Mnemonic generator unavailable")
+    return gen_func(k)
 
 st.set_page_config(page_title="Kanji Mnemonics", page_icon="🔎", layout="centered")
 st.title("Kanji Search with Mnemonics")
@@ -158,7 +214,7 @@ st.title("Kanji Search with Mnemonics")
 with st.sidebar:
     st.header("Data Files")
 
-kanji_data = load_kanji_data()
+kanji_index = load_kanji_index()
 mnemonic_idx = load_mnemonics_index()
 
 query = st.text_input("Enter a single kanji", max_chars=3, help="Type one kanji character (e.g., 人, 日, 学)")
@@ -168,7 +224,7 @@ if query:
     if len(k) != 1:
         st.error("Please enter exactly one kanji character.")
     else:
-        info = kanji_data.get(k)
+        info = get_kanji_info(k)
         if not info:
             st.warning("Kanji not found in the dataset.")
         else:
@@ -246,12 +302,10 @@ if query:
             if stroke_file:
                 svg_path = KANJI_SVG_DIR / str(stroke_file)
                 if svg_path.exists():
-                    svg_content = _read_svg(svg_path)
-                    if svg_content:
-                        clean_svg = _sanitize_svg_for_embed(svg_content)
-                        stroke_col = "#ffffff" if hc else "#000000"
-                        number_col = "#ffffff" if hc else "#808080"
-                        tuned_svg = _inject_svg_style(clean_svg, stroke_color=stroke_col, number_color=number_col, stroke_width=sw, show_numbers=show_nums)
+                    stroke_col = "#ffffff" if hc else "#000000"
+                    number_col = "#ffffff" if hc else "#808080"
+                    tuned_svg = _load_styled_svg(str(svg_path), svg_path.stat().st_mtime, stroke_col, number_col, sw, show_nums)
+                    if tuned_svg:
                         svg_html = f"<div style=\"max-width: 420px;\">{tuned_svg}</div>"
             if svg_html:
                 st.markdown(svg_html, unsafe_allow_html=True)
@@ -260,17 +314,21 @@ if query:
                 st.write("—")
 
             st.divider()
-            st.subheader("Mnemonic (generated via Notebook)")
-            line_shown = None
-            gen_func = load_notebook_generator()
-            if gen_func is None:
-                st.warning("Notebook generator unavailable. Ensure RAG_Mnemonics.ipynb is present and dependencies are installed.")
-            else:
-                with st.spinner("Generating mnemonic using the notebook code (may be slow on CPU)…"):
-                    try:
-                        line_shown = gen_func(k)
-                    except Exception:
-                        line_shown = None
+            st.subheader("Mnemonic (generated via RAG)")
+            # Models are only imported/loaded on demand so browsing kanji stays fast
+            generated: Dict[str, Optional[str]] = st.session_state.setdefault("generated_mnemonics", {})
+            if st.button("Generate mnemonic", help="Loads the retrieval and language models on first use"):
+                gen_func = load_generator()
+                if gen_func is None:
+                    st.warning("Mnemonic generator unavailable. Ensure rag_mnemonics.py is present and dependencies are installed.")
+                else:
+                    with st.spinner("Generating mnemonic (may be slow on CPU)…"):
+                        try:
+                            generated[k] = generate_mnemonic_cached(k)
+                        except Exception:
+                            generated[k] = None
+            if k in generated:
+                line_shown = generated[k]
                 if line_shown:
                     st.success(line_shown)
                 else:
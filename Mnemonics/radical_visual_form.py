@@ -1,8 +1,8 @@
 import sys
 import io
+import asyncio
+import httpx
 import pandas as pd
-import subprocess
-import time
 from datetime import datetime
 
 # ✅ Force UTF-8 output on Windows (avoids charmap crash)
@@ -20,8 +20,13 @@ def safe_print(*args, **kwargs):
 # ✅ Load radicals
 df = pd.read_csv(r"C:\Users\ragur\Japanese_Learning_Application\Mnemonics\japanese-radicals.csv")
 
+# ✅ Ollama HTTP API (one keep-alive connection pool instead of a subprocess per radical)
+OLLAMA_URL = "http://localhost:11434/api/generate"
+OLLAMA_MODEL = "qwen2.5:1.5b"
+CONCURRENCY = 8
+
 # ✅ Generate function using Qwen
-def generate_visual_form_ollama(radical, meaning, retries=2):
+async def generate_visual_form_ollama(client, semaphore, radical, meaning, retries=2):
     prompt = f"""
         You are a visual description assistant for JAPANESE radicals.
         Your task: Describe, in under 10 words, what the radical *looks like* and how it visually connects to its meaning.
@@ -40,43 +45,45 @@ def generate_visual_form_ollama(radical, meaning, retries=2):
 
     for attempt in range(retries):
         try:
-            result = subprocess.run(
-                ["ollama", "run", "qwen2.5:1.5b"],
-                input=prompt,
-                text=True,
-                capture_output=True,
-                check=True,
-                encoding='utf-8'
-            )
-            response = result.stdout.strip()
-            return response
-        except subprocess.CalledProcessError as e:
-            safe_print(f"⚠️ Ollama error for {radical}: {e.stderr.strip()}")
+            async with semaphore:
+                r = await client.post(OLLAMA_URL, json={
+                    "model": OLLAMA_MODEL,
+                    "prompt": prompt,
+                    "stream": False,
+                    "keep_alive": "30m",
+                })
+            r.raise_for_status()
+            return r.json()["response"].strip()
+        except httpx.HTTPStatusError as e:
+            safe_print(f"⚠️ Ollama error for {radical}: {e.response.text.strip()}")
         except Exception as e:
             safe_print(f"⚠️ Other error for {radical}: {e}")
-        time.sleep(1)
     return ""
 
+async def generate_all(pairs):
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    async with httpx.AsyncClient(timeout=60) as client:
+        return await asyncio.gather(*[
+            generate_visual_form_ollama(client, semaphore, radical, meaning)
+            for radical, meaning in pairs
+        ])
+
 # ✅ Timestamp for file names
 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 csv_path = f"radicals_with_visual_form_{timestamp}.csv"
 txt_path = f"radical_visual_descriptions_{timestamp}.txt"
 
-# ✅ Prepare for output
-visual_forms = []
+# ✅ Generate concurrently (results come back in input order)
+pairs = list(df[["Radical", "Meaning"]].itertuples(index=False, name=None))
+safe_print(f"\n🔹 Generating visual forms for {len(pairs)} radicals ({CONCURRENCY} concurrent requests)...")
+visual_forms = asyncio.run(generate_all(pairs))
 
 # ✅ Text log file
 with open(txt_path, "w", encoding="utf-8") as log_file:
-    for i, row in df.iterrows():
-        radical, meaning = row["Radical"], row["Meaning"]
-        safe_print(f"\n🔹 Generating for {radical} ({meaning})...")
-        visual = generate_visual_form_ollama(radical, meaning)
-        visual_forms.append(visual)
-
+    for (radical, meaning), visual in zip(pairs, visual_forms):
         # ✅ Print and log
-        safe_print(f"✨ Visual form: {visual}")
+        safe_print(f"✨ {radical} ({meaning}): {visual}")
         log_file.write(f"{radical} ({meaning}): {visual}\n")
-        time.sleep(1)
 
 # ✅ Save to CSV
 df["Visual_Form"] = visual_forms
@@ -0,0 +1,496 @@
+"""RAG mnemonic generator extracted from RAG_Mnemonics.ipynb.
+
+Heavy dependencies (pandas, sentence-transformers, faiss, transformers) are
+imported lazily by the ``_ensure_*`` helpers on the first generation, so
+importing this module is cheap.
+"""
+from __future__ import annotations
+import hashlib
+import json
+import mmap
+import re
+import threading
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+import orjson
+
+# ---------- Paths ----------
+HERE = Path(__file__).parent
+KANJI_JSON = HERE / "merged_kanji.json"
+RADICALS_CSV = HERE / "radicals_with_visual_form_20251029_104855.csv"
+# Append-only log of generated mnemonics; doubles as the generation cache
+MNEMONICS_JSONL = HERE / "generated_mnemonics_v3.jsonl"
+
+EMBED_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+GEN_MODEL = "Qwen/Qwen2.5-1.5B-Instruct"
+
+# Below this many radical docs an exact flat scan is as fast as HNSW and has perfect recall
+HNSW_MIN_DOCS = 500
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 32
+
+# ---------- Lazily initialised state ----------
+_KANJI_DATA: Optional[Dict[str, Any]] = None
+_RADICAL_DOCS: Optional[List[str]] = None
+_RADICAL_DOCS_ARR = None  # object ndarray view of _RADICAL_DOCS for fancy-index gathers
+_EMBEDDER = None
+_FAISS_INDEX = None
+_PIPE = None
+_PREFIX_CACHE = None  # (prefix input_ids, past_key_values) for _PROMPT_PREFIX
+_MNEMONIC_CACHE: Optional[Dict[str, str]] = None  # kanji -> mnemonic line
+# Streamlit sessions run on separate threads; without this two first requests can each load the models.
+# Re-entrant because _ensure_radical_index calls _ensure_embedder.
+_INIT_LOCK = threading.RLock()
+
+# ---------- Utilities ----------
+_NON_ASCII_RE = re.compile(r"[^\x00-\x7F]+")
+_TAG_RE = re.compile(r"<[^>]*>")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+_WS_RE = re.compile(r"\s+")
+_SENTENCE_END_CHARS = frozenset(".!?")
+
+# str.isascii() is a single C scan; the regex only runs when there is something to remove
+def _to_ascii(text: str) -> str:
+    t = str(text)
+    return (t if t.isascii() else _NON_ASCII_RE.sub(" ", t)).strip()
+
+def _one_sentence(text: str, max_chars: int = 120) -> str:
+    t = (text or "").strip()
+    t = _TAG_RE.sub("", t)
+    t = t.split("→", 1)[0]
+    parts = _SENTENCE_END_RE.split(t, maxsplit=1)
+    one = parts[0] if parts else t
+    one = _WS_RE.sub(" ", one).strip()
+    if len(one) > max_chars:
+        one = one[:max_chars].rstrip(" ,;:") + "…"
+    return one
+
+def _finalize_rhs(text: str, max_chars: int = 120) -> str:
+    """Single-pass equivalent of ``_one_sentence(strip_cjk(text))`` minus leading ``=``.
+
+    Drops kana/kanji and ``<tags>``, stops at ``→`` or the first sentence end,
+    collapses whitespace and truncates to ``max_chars``.
+    """
+    out: List[str] = []
+    prev = ""
+    pending_space = False
+    i, end = 0, len(text or "")
+    while i < end:
+        ch = text[i]
+        o = ord(ch)
+        if 0x3040 <= o <= 0x30FF or 0x3400 <= o <= 0x4DBF or 0x4E00 <= o <= 0x9FFF or 0xF900 <= o <= 0xFAFF:
+            i += 1
+            continue
+        if ch == "<":
+            close = text.find(">", i + 1)
+            if close != -1:
+                i = close + 1
+                continue
+        if ch == "→":
+            break
+        if ch.isspace():
+            if prev in _SENTENCE_END_CHARS:
+                break
+            pending_space = True
+            i += 1
+            continue
+        if pending_space and out:
+            out.append(" ")
+        pending_space = False
+        out.append(ch)
+        prev = ch
+        if len(out) > max_chars:
+            break
+        i += 1
+    one = "".join(out)
+    if len(one) > max_chars:
+        one = one[:max_chars].rstrip(" ,;:") + "…"
+    # Only single spaces remain, so this matches stripping ^[=\s]+
+    return one.lstrip("= ")
+
+# ---------- Loaders ----------
+@lru_cache(maxsize=None)
+def _get_torch():
+    """Import torch on first use; it is the slowest and largest of the lazy imports."""
+    import torch
+
+    return torch
+
+def _ensure_kanji_data() -> None:
+    global _KANJI_DATA
+    if _KANJI_DATA is not None:
+        return
+    with _INIT_LOCK:
+        if _KANJI_DATA is not None:
+            return
+        # orjson parses the mapped bytes directly, skipping the read() + str decode pass
+        with KANJI_JSON.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                data = orjson.loads(view)
+        _KANJI_DATA = data if isinstance(data, dict) else {}
+
+def _radical_cache_paths() -> Tuple[Path, Path]:
+    """On-disk FAISS index and doc list, keyed by the CSV content and embedding model."""
+    h = hashlib.md5(RADICALS_CSV.read_bytes())
+    h.update(EMBED_MODEL.encode("utf-8"))
+    key = h.hexdigest()[:8]
+    return HERE / f"radicals_{key}.faiss", HERE / f"radicals_{key}.json"
+
+def _ensure_embedder() -> None:
+    global _EMBEDDER
+    if _EMBEDDER is not None:
+        return
+    with _INIT_LOCK:
+        if _EMBEDDER is not None:
+            return
+        from sentence_transformers import SentenceTransformer
+
+        _EMBEDDER = SentenceTransformer(EMBED_MODEL)
+
+def _ensure_radical_index() -> None:
+    global _RADICAL_DOCS, _RADICAL_DOCS_ARR, _FAISS_INDEX
+    if _FAISS_INDEX is not None:
+        return
+    with _INIT_LOCK:
+        if _FAISS_INDEX is not None:
+            return
+        import faiss
+        import numpy as np
+
+        index_path, docs_path = _radical_cache_paths()
+        if index_path.exists() and docs_path.exists():
+            try:
+                with docs_path.open("r", encoding="utf-8") as f:
+                    docs = json.load(f)
+                index = faiss.read_index(str(index_path))
+            except Exception:
+                pass
+            else:
+                if isinstance(docs, list) and index.ntotal == len(docs):
+                    _RADICAL_DOCS = docs
+                    _RADICAL_DOCS_ARR = np.array(docs, dtype=object)
+                    _FAISS_INDEX = index
+                    return
+
+        import pandas as pd
+
+        radicals_df = pd.read_csv(RADICALS_CSV, usecols=["Radical", "Meaning"], dtype=str)
+        docs: List[str] = [
+            f"Radical: {_to_ascii(radical)}\nMeaning: {_to_ascii(meaning)}"
+            for radical, meaning in radicals_df[["Radical", "Meaning"]].itertuples(index=False, name=None)
+        ]
+
+        _ensure_embedder()
+        # Unit-length vectors make inner product equal to cosine similarity
+        radical_embeddings = _EMBEDDER.encode(docs, batch_size=64, convert_to_numpy=True, normalize_embeddings=True)
+        radical_embeddings = np.ascontiguousarray(radical_embeddings, dtype=np.float32)
+        dim = radical_embeddings.shape[1]
+        if len(docs) >= HNSW_MIN_DOCS:
+            index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            index.hnsw.efSearch = HNSW_EF_SEARCH
+        else:
+            index = faiss.IndexFlatIP(dim)
+        index.add(radical_embeddings)
+
+        # Best effort: a read-only checkout just rebuilds on the next start
+        try:
+            faiss.write_index(index, str(index_path))
+            with docs_path.open("w", encoding="utf-8") as f:
+                json.dump(docs, f, ensure_ascii=False)
+        except Exception:
+            pass
+
+        _RADICAL_DOCS = docs
+        _RADICAL_DOCS_ARR = np.array(docs, dtype=object)
+        _FAISS_INDEX = index
+
+def _ensure_pipe() -> None:
+    global _PIPE
+    if _PIPE is not None:
+        return
+    with _INIT_LOCK:
+        if _PIPE is not None:
+            return
+        from transformers import pipeline
+
+        torch = _get_torch()
+
+        model_kwargs: Dict[str, Any] = {}
+        # 4-bit NF4 weights on GPU when bitsandbytes is available; CPU keeps the default dtype
+        if torch.cuda.is_available():
+            try:
+                import bitsandbytes  # noqa: F401
+                from transformers import BitsAndBytesConfig
+            except ImportError:
+                pass
+            else:
+                model_kwargs["quantization_config"] = BitsAndBytesConfig(
+                    load_in_4bit=True,
+                    bnb_4bit_compute_dtype=torch.bfloat16,
+                    bnb_4bit_quant_type="nf4",
+                )
+
+        pipe = pipeline(
+            "text-generation",
+            model=GEN_MODEL,
+            torch_dtype="auto",
+            device_map="auto",
+            model_kwargs=model_kwargs,
+        )
+        # Batched generation needs a pad token; decoder-only models pad on the left
+        pipe.tokenizer.padding_side = "left"
+        if pipe.tokenizer.pad_token is None:
+            pipe.tokenizer.pad_token = pipe.tokenizer.eos_token
+        _PIPE = pipe
+
+def _ensure_mnemonic_cache() -> None:
+    global _MNEMONIC_CACHE
+    if _MNEMONIC_CACHE is not None:
+        return
+    with _INIT_LOCK:
+        if _MNEMONIC_CACHE is not None:
+            return
+        cache: Dict[str, str] = {}
+        if MNEMONICS_JSONL.exists():
+            with MNEMONICS_JSONL.open("rb") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        obj = orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        continue
+                    if not isinstance(obj, dict):
+                        continue
+                    k = obj.get("kanji")
+                    mnemonic = (obj.get("mnemonic") or "").strip()
+                    if k and mnemonic:
+                        # last one wins (resume runs)
+                        cache[k] = mnemonic
+        _MNEMONIC_CACHE = cache
+
+def _remember_mnemonic(k: str, line: str, details: Dict[str, Any]) -> None:
+    """Add a generated line to the cache and append it to MNEMONICS_JSONL in the batch-run format."""
+    mlist = details.get("meanings") or []
+    meaning = mlist[0] if isinstance(mlist, list) and mlist else (details.get("meaning") or "")
+    rhs = line.split("→", 1)[1] if "→" in line else meaning
+    reminder = _finalize_rhs(rhs, max_chars=40) or _one_sentence(meaning or "core idea", max_chars=24)
+    record = {
+        "kanji": k,
+        "mnemonic": line,
+        "meaning": meaning,
+        "reminder": reminder,
+        "created_at": datetime.now(timezone.utc).replace(tzinfo=None).isoformat() + "Z",
+    }
+    with _INIT_LOCK:
+        _MNEMONIC_CACHE[k] = line
+        # Best effort: the in-memory cache still works on a read-only checkout
+        try:
+            with MNEMONICS_JSONL.open("ab") as f:
+                f.write(orjson.dumps(record) + b"\n")
+        except OSError:
+            pass
+
+# ---------- Retrieval ----------
+def _retrieve_relevant_radicals_batch(queries: List[str], top_k: int = 3) -> List[List[str]]:
+    """Encode all queries in one embedder call and search them in one FAISS call."""
+    import numpy as np
+
+    if not queries:
+        return []
+    _ensure_radical_index()
+    if _FAISS_INDEX.ntotal == 0:
+        return [[] for _ in queries]
+    _ensure_embedder()
+    query_emb = _EMBEDDER.encode(queries, batch_size=32, convert_to_numpy=True, normalize_embeddings=True)
+    D, I = _FAISS_INDEX.search(np.ascontiguousarray(query_emb, dtype=np.float32), top_k)
+    # FAISS pads missing neighbours with -1
+    valid = (I >= 0) & (I < len(_RADICAL_DOCS_ARR))
+    return [_RADICAL_DOCS_ARR[row[mask]].tolist() for row, mask in zip(I, valid)]
+
+def _retrieve_relevant_radicals(query_text: str, top_k: int = 3) -> List[str]:
+    return _retrieve_relevant_radicals_batch([query_text], top_k)[0]
+
+# ---------- Generation ----------
+_SAMPLING_KWARGS: Dict[str, Any] = dict(
+    max_new_tokens=80,
+    temperature=0.4,
+    top_p=0.8,
+    do_sample=True,
+)
+
+# Kanji-independent instructions come first so their KV cache can be computed once and reused
+_PROMPT_PREFIX = """
+You are a Kanji mnemonic generator.
+Combine the radicals’ meanings to create a short, logical English mnemonic.
+
+Rules:
+- Use ONLY English words and ASCII punctuation. Never include Japanese/Chinese (kanji, kana, hanzi) in the mnemonic.
+- Ignore any non-English visual descriptions; translate their ideas into simple English or omit them.
+- Keep it under 120 characters.
+- Output exactly one line. No extra text.
+
+Example:
+買 = Net + Shell → Buying involves catching valuable shells in a net.
+"""
+
+def _radical_query(details: Dict[str, Any]) -> str:
+    return " ".join(details.get("wk_radicals", []))
+
+def _build_prompt_suffix(k: str, details: Dict[str, Any], radical_docs: List[str]) -> Tuple[str, str, str]:
+    """Return (suffix, lhs, meanings); the full prompt is ``_PROMPT_PREFIX + suffix``."""
+    meanings = ", ".join(details.get("meanings", []))
+    radicals_en = details.get("wk_radicals", [])
+    lhs = " + ".join(radicals_en) if radicals_en else meanings
+
+    radical_context = "\n\n".join(radical_docs)
+
+    suffix = f"""
+Follow this exact one-line format:
+{k} = {lhs} → <short, clear mnemonic>
+
+Context about the radicals (English-only):
+{radical_context}
+
+Now generate for {k} ("{meanings}").
+"""
+    return suffix, lhs, meanings
+
+def _ensure_prefix_cache() -> None:
+    global _PREFIX_CACHE
+    if _PREFIX_CACHE is not None:
+        return
+    with _INIT_LOCK:
+        if _PREFIX_CACHE is not None:
+            return
+        torch = _get_torch()
+        _ensure_pipe()
+        model, tokenizer = _PIPE.model, _PIPE.tokenizer
+        prefix_ids = tokenizer(_PROMPT_PREFIX, return_tensors="pt").input_ids.to(model.device)
+        with torch.no_grad():
+            prefix_kv = model(input_ids=prefix_ids, use_cache=True).past_key_values
+        _PREFIX_CACHE = (prefix_ids, prefix_kv)
+
+def _generate_with_prefix_cache(suffix: str) -> str:
+    """Generate for ``_PROMPT_PREFIX + suffix`` reusing the prefix KV cache, so only the
+    suffix is prefilled. Prefix and suffix are tokenized separately so the cached tokens
+    are exactly the leading tokens of the input.
+    """
+    import copy
+
+    torch = _get_torch()
+    _ensure_prefix_cache()
+    prefix_ids, prefix_kv = _PREFIX_CACHE
+    model, tokenizer = _PIPE.model, _PIPE.tokenizer
+    suffix_ids = tokenizer(suffix, return_tensors="pt", add_special_tokens=False).input_ids.to(prefix_ids.device)
+    input_ids = torch.cat([prefix_ids, suffix_ids], dim=-1)
+    with torch.no_grad():
+        out = model.generate(
+            input_ids=input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            # generate() extends the cache in place, so each call gets its own copy
+            past_key_values=copy.deepcopy(prefix_kv),
+            use_cache=True,
+            pad_token_id=tokenizer.pad_token_id,
+            **_SAMPLING_KWARGS,
+        )
+    return tokenizer.decode(out[0, input_ids.shape[-1]:], skip_special_tokens=True).strip()
+
+def _generated_text(resp: Any) -> str:
+    return resp[0]["generated_text"].strip() if resp and isinstance(resp, list) else str(resp).strip()
+
+@lru_cache(maxsize=256)
+def _line_patterns(k: str, lhs: str, meanings: str) -> Tuple[re.Pattern[str], Optional[re.Pattern[str]], Optional[re.Pattern[str]]]:
+    """Compiled per-kanji patterns: the arrow line, and leading lhs/meanings echoes to trim."""
+    line_re = re.compile(rf"{re.escape(k)}\s*=\s*.*?→.*")
+    lhs_re = re.compile(rf"^(?:{re.escape(lhs.strip())}\b\s*:?\s*)+", re.I) if lhs else None
+    meanings_re = re.compile(rf"^(?:{re.escape(meanings.strip())}\b\s*:?\s*)+", re.I) if meanings else None
+    return line_re, lhs_re, meanings_re
+
+def _postprocess(k: str, lhs: str, meanings: str, text: str) -> str:
+    """Reduce raw model output to a single clean ``k = lhs → sentence.`` line."""
+    line_re, lhs_re, meanings_re = _line_patterns(k, lhs, meanings)
+    text = _WS_RE.sub(" ", text.replace("|", " "))
+
+    match = line_re.search(text)
+    if match:
+        line = match.group(0).strip()
+    else:
+        line = f"{k} = {lhs} → Represents {meanings.lower()} through its parts."
+
+    if "→" in line:
+        left, right = line.split("→", 1)
+        right = _finalize_rhs(right, max_chars=120)
+        if lhs_re is not None:
+            right = lhs_re.sub("", right)
+        if meanings_re is not None:
+            right = meanings_re.sub("", right)
+        right = right.strip()
+        if not right:
+            right = _one_sentence(f"Represents {meanings.lower()}.", max_chars=120)
+        if right and right[-1] not in ".!?…":
+            right += "."
+        line = f"{left.strip()} → {right}"
+
+    return line
+
+def generate_mnemonic(kanji: str, refresh: bool = False) -> str:
+    """Mnemonic line for ``kanji``. Previously generated lines (from MNEMONICS_JSONL)
+    are returned without touching the models unless ``refresh`` is set.
+    """
+    k = kanji.strip()
+    _ensure_mnemonic_cache()
+    if not refresh and _MNEMONIC_CACHE.get(k):
+        return _MNEMONIC_CACHE[k]
+
+    _ensure_kanji_data()
+    details = _KANJI_DATA.get(k)
+    if not details:
+        return f"Kanji {k} not found."
+
+    radical_docs = _retrieve_relevant_radicals(_radical_query(details))
+    suffix, lhs, meanings = _build_prompt_suffix(k, details, radical_docs)
+    line = _postprocess(k, lhs, meanings, _generate_with_prefix_cache(suffix))
+    _remember_mnemonic(k, line, details)
+    return line
+
+def generate_mnemonics(kanjis: List[str], batch_size: int = 8, refresh: bool = False) -> List[str]:
+    """Batched ``generate_mnemonic``: all uncached prompts go through one pipeline call.
+    Results are returned in input order.
+    """
+    _ensure_mnemonic_cache()
+    _ensure_kanji_data()
+    results: List[Optional[str]] = [None] * len(kanjis)
+    found: List[Tuple[int, str, Dict[str, Any]]] = []
+    for i, kanji in enumerate(kanjis):
+        k = kanji.strip()
+        if not refresh and _MNEMONIC_CACHE.get(k):
+            results[i] = _MNEMONIC_CACHE[k]
+            continue
+        details = _KANJI_DATA.get(k)
+        if not details:
+            results[i] = f"Kanji {k} not found."
+            continue
+        found.append((i, k, details))
+
+    all_docs = _retrieve_relevant_radicals_batch([_radical_query(details) for _, _, details in found])
+    pending: List[Tuple[int, str, Dict[str, Any], str, str]] = []
+    prompts: List[str] = []
+    for (i, k, details), radical_docs in zip(found, all_docs):
+        suffix, lhs, meanings = _build_prompt_suffix(k, details, radical_docs)
+        pending.append((i, k, details, lhs, meanings))
+        prompts.append(_PROMPT_PREFIX + suffix)
+
+    if prompts:
+        _ensure_pipe()
+        resps = _PIPE(prompts, batch_size=min(batch_size, len(prompts)), return_full_text=False, **_SAMPLING_KWARGS)
+        for (i, k, details, lhs, meanings), resp in zip(pending, resps):
+            line = _postprocess(k, lhs, meanings, _generated_text(resp))
+            _remember_mnemonic(k, line, details)
+            results[i] = line
+    return [r or "" for r in results]